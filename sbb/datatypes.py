@@ -1,11 +1,16 @@
 from __future__ import annotations
 import re
-import math
+import heapq
+import struct
 import inspect
+import operator
 from abc import ABC, abstractmethod
-from collections.abc import Iterable
-from types import UnionType
-from typing import Optional, Any, Callable, Sequence, ClassVar
+from collections import defaultdict
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import CodeType, MethodType, UnionType
+from typing import Optional, Any, Callable, Sequence, ClassVar, Union, get_args, get_origin
 from pathlib import Path
 from .errors import DataMissingError, ValidationError, BuildError
 
@@ -23,10 +28,132 @@ RESERVED_NAMES = [
     'root_path',
 ]
 
+_OFFSET_CALL_RE = re.compile(r'self\.(.+?)\.offset\(\)')
+_OFFSET_OF_RE = re.compile(r'self\.offset_of\([\'"](.+?)[\'"]\)')
+
+# struct format characters for primitives that can be packed in bulk
+_PACK_FORMATS = {1: 'B', 2: 'H', 4: 'I'}
+
+# Shared padding for the common Align sizes (up to 16-byte alignment)
+_ZERO_PADS = [bytes(i) for i in range(17)]
+
+_ANNOT_CACHE: dict[type, dict[str, Any]] = {}
+
+
+def _get_anns(cls: type) -> dict[str, Any]:
+    '''Gets the evaluated annotations of a class. These are resolved once per
+    class and cached, since the shape of a datatype is fixed after its class
+    is defined.'''
+
+    cached = _ANNOT_CACHE.get(cls)
+    if cached is None:
+        cached = inspect.get_annotations(cls, eval_str=True)
+        _ANNOT_CACHE[cls] = cached
+    return cached
+
+
+# The innermost Block or Array currently being built. If a build fails, this
+# is left pointing at the object that failed, so the build that adds the
+# notes can trace it
+_current_build: ContextVar[Optional[DataType]] = ContextVar('_current_build', default=None)
+
+
+def _add_build_notes(e: BuildError, outermost: DataType) -> None:
+    '''Adds a note to the exception for each level of the data tree that was
+    being built when it was raised, from the innermost up to the outermost.'''
+
+    obj = _current_build.get()
+    while obj is not None:
+        if isinstance(obj, Array):
+            e.add_note(f'Array[{obj._datatype.__name__}] -> (element {len(obj)})')
+        elif hasattr(obj, '_current_item'):
+            item = obj._current_item
+            e.add_note(f'{obj.type_name()} -> {item.name}: {item.datatype.__name__}')
+        if obj is outermost:
+            break
+        obj = obj.parent
+
+
+@contextmanager
+def _building(obj: DataType) -> Iterator[None]:
+    '''Marks a Block or Array as being built. If the build fails, the outermost
+    build (or one that isn't a child of the enclosing build) adds notes for its
+    levels of the tree and hands the context back to the enclosing build.'''
+
+    enclosing = _current_build.get()
+    token = _current_build.set(obj)
+    try:
+        yield
+    except BaseException as e:
+        if enclosing is None or obj.parent is not enclosing:
+            if isinstance(e, BuildError):
+                _add_build_notes(e, obj)
+            _current_build.reset(token)
+        raise
+    _current_build.reset(token)
+
+
+_DEPENDENCY_CACHE: dict[type, dict[str, list[str]]] = {}
+_SETTER_NAMES_CACHE: dict[CodeType, frozenset[str]] = {}
+_SETTER_SOURCE_CACHE: dict[CodeType, tuple[str, list[str]]] = {}
+
+
+def _get_setter_names(setter: Callable) -> frozenset[str]:
+    '''Gets the unbound names (such as attribute names) used by a setter,
+    cached per setter function.'''
+
+    key = setter.__code__
+    cached = _SETTER_NAMES_CACHE.get(key)
+    if cached is None:
+        cached = frozenset(inspect.getclosurevars(setter).unbound)
+        _SETTER_NAMES_CACHE[key] = cached
+    return cached
+
+
+def _get_setter_source(setter: Callable) -> tuple[str, list[str]]:
+    '''Gets the source of a setter and the property names it calls `offset()`
+    or `offset_of()` on, cached per setter function.'''
+
+    key = setter.__code__
+    cached = _SETTER_SOURCE_CACHE.get(key)
+    if cached is None:
+        source = inspect.getsource(setter)
+        called_props = _OFFSET_CALL_RE.findall(source)
+        called_props += _OFFSET_OF_RE.findall(source)
+        cached = (source, called_props)
+        _SETTER_SOURCE_CACHE[key] = cached
+    return cached
+
+
+class _hybridmethod:
+    '''A method that behaves as a class method when called on the class, and
+    as a separately-defined instance method when called on an instance. The
+    instance method is added using the `instancemethod` decorator, similar to
+    a property setter.'''
+
+    def __init__(self, classfunc: Callable) -> None:
+        self.classfunc = classfunc
+        self.instancefunc: Optional[Callable] = None
+        self.__doc__ = classfunc.__doc__
+
+    def instancemethod(self, instancefunc: Callable) -> _hybridmethod:
+        self.instancefunc = instancefunc
+        return self
+
+    def __get__(self, obj: Any, objtype: Optional[type] = None) -> Callable:
+        if obj is None or self.instancefunc is None:
+            return MethodType(self.classfunc, objtype if objtype is not None else type(obj))
+        return MethodType(self.instancefunc, obj)
+
 
 class DataType(ABC):
     '''The abstract base class of all SBB datatypes.'''
 
+    # Subclasses that can be slotted declare `parent` themselves, because
+    # `_Primitive` (an `int`) and `Array` (a `list`) can't share a base class
+    # with non-empty slots
+    __slots__ = ()
+
     parent: Optional[Block]
 
     def __init__(self, parent: Optional[Block]) -> None:
@@ -51,6 +178,12 @@ class DataType(ABC):
         return offset
 
     def _offset_in_parent_array(self, parent: Array) -> int:
+        if parent._has_element_offsets():
+            # An element that isn't in the array yet is still being built, and
+            # will be placed at the end
+            index = parent._id_to_index.get(id(self), len(parent))
+            if index == len(parent) or parent[index] is self:
+                return parent._element_offset(index)
         offset = 0
         for elem in parent:
             if elem is self:
@@ -59,8 +192,10 @@ class DataType(ABC):
         return offset
 
     def _offset_in_parent_block(self, parent: Block) -> int:
+        if parent._offset_table is not None and id(self) in parent._id_to_name:
+            return parent._offset_table[parent._id_to_name[id(self)]]
         offset = 0
-        for name, datatype in inspect.get_annotations(type(parent), eval_str=True).items():
+        for name, datatype in _get_anns(type(parent)).items():
             attr = getattr(parent, name, datatype)
             if attr is self:
                 return offset
@@ -89,11 +224,16 @@ class DataType(ABC):
         if not parent:
             return ''
         if isinstance(parent, Array):
+            index = parent._id_to_index.get(id(self))
+            if index is not None and index < len(parent) and parent[index] is self:
+                return f'Element {index}'
             for i, elem in enumerate(parent):
                 if elem is self:
                     return f'Element {i}'
+        elif parent._offset_table is not None and id(self) in parent._id_to_name:
+            return parent._id_to_name[id(self)]
         else:
-            annotations = inspect.get_annotations(type(parent))
+            annotations = _get_anns(type(parent))
             items = [(name, getattr(parent, name)) for name in annotations]
             for name, item in items:
                 if item is self:
@@ -108,12 +248,19 @@ class DataType(ABC):
     @abstractmethod
     def size(cls) -> int:
         '''Gets the size (in bytes) of the data in this datatype. Usable as
-        either a class method or an instance method.'''
+        either a class method or an instance method.
+
+        The size of a `Block` or `Array` is cached once it's built, so it won't
+        reflect any changes made to the data afterward.'''
         ...
 
     @abstractmethod
     def to_bytes(self) -> bytes:
-        '''Gets the raw bytes of the data in this datatype.'''
+        '''Gets the raw bytes of the data in this datatype.
+
+        The bytes of a `Block` or `Array` are cached the first time they're
+        generated after it's built, so they won't reflect any changes made to
+        the data afterward.'''
         ...
 
     @abstractmethod
@@ -128,12 +275,17 @@ class DataType(ABC):
 
         datatype = type(self)
         if datatype.__name__ == 'Array' and self.parent:
-            annotations = inspect.get_annotations(type(self.parent))
-            for name, type_name in annotations.items():
+            annotations = _get_anns(type(self.parent))
+            for name, annotation in annotations.items():
                 if getattr(self.parent, name) is self:
-                    array_type = re.match(r'.*\[.*\.(.*)\]', str(type_name))
-                    if array_type:
-                        return f'Array[{array_type.group(1)}]'
+                    # The Array may be one member of a union, like Array[U8] | Empty
+                    candidates = (annotation,)
+                    if get_origin(annotation) in (Union, UnionType):
+                        candidates = get_args(annotation)
+                    for candidate in candidates:
+                        args = get_args(candidate)
+                        if get_origin(candidate) is Array and args:
+                            return f'Array[{args[0].__name__}]'
         return datatype.__name__
 
 
@@ -142,43 +294,61 @@ class _Primitive(DataType, int):
     and `U32`.'''
 
     bit_size: ClassVar[int]
+    _byte_size: ClassVar[int]
+    _range_min: ClassVar[int]
+    _range_max: ClassVar[int]
     _data: int
 
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        if hasattr(cls, 'bit_size'):
+            cls._byte_size = cls.bit_size // 8
+            cls._range_min = -(1 << (cls.bit_size - 1))
+            cls._range_max = (1 << cls.bit_size) - 1
+
     def __new__(cls, _: Optional[Block], data: int):
-        valid = False
+        # Subclasses may convert the data in __init__ before passing it on, so
+        # it's only coerced here and validated in __init__
         try:
-            int(data)
-            valid = True
-        except ValueError:
-            pass
-        if not valid:
+            value = data if type(data) is int else int(data)
+        except (TypeError, ValueError):
             type_name = type(data).__name__
-            raise ValidationError(f"Expected int type, received {type_name}")
-        return super(_Primitive, cls).__new__(cls, data)
+            raise ValidationError(f"Expected int type, received {type_name}") from None
+        return super(_Primitive, cls).__new__(cls, value)
 
     def __init__(self, parent: Optional[Block], data: int) -> None:
-        self._data = data
+        self._data = self._to_valid_int(data)
         super().__init__(parent)
 
+    @classmethod
+    def _to_valid_int(cls, data: Any) -> int:
+        if type(data) is not int:
+            try:
+                data = operator.index(data)
+            except TypeError:
+                type_name = type(data).__name__
+                raise ValidationError(f"Expected int type, received {type_name}") from None
+        if not cls._range_min <= data <= cls._range_max:
+            raise ValidationError(f"Value {data} outside of range, must be {cls._range_min} to {cls._range_max}")
+        return data
+
     def _get_data(self) -> int:
         return self._data
 
     @classmethod
     def size(cls) -> int:
-        return cls.bit_size // 8
+        return cls._byte_size
 
     @classmethod
     def static_size(cls) -> int:
-        return cls.bit_size // 8
+        return cls._byte_size
 
     def to_bytes(self) -> bytes:
-        return self._data.to_bytes(self.size(), signed=self._data < 0)
+        return self._data.to_bytes(self._byte_size, signed=self._data < 0)
 
     def _validate(self) -> None:
-        range_min = -int(math.pow(2, self.bit_size - 1))
-        range_max = int(math.pow(2, self.bit_size) - 1)
-        if self._data < range_min or self._data > range_max:
-            raise ValidationError(f"Value {self._data} outside of range, must be {range_min} to {range_max}")
+        # Validated in _to_valid_int
+        pass
 
     def __repr__(self) -> str:
         return f'{self._get_data()} ({hex(self._get_data())})'
@@ -205,10 +375,11 @@ class U32(_Primitive):
 class Bytes(DataType):
     '''A sequence of raw bytes.'''
 
+    __slots__ = ('parent', '_data')
+
     _data: bytes
 
     def __init__(self, parent: Optional[Block], data: bytes = bytes(0)) -> None:
-        self.size = self._size
         if isinstance(data, str):
             data = data.encode('utf-8')
         self._data = data
@@ -217,11 +388,12 @@ class Bytes(DataType):
     def _get_data(self) -> bytes:
         return self._data
 
-    @classmethod
+    @_hybridmethod
     def size(cls) -> int:
         raise DataMissingError("Attempted to get size of a Bytes object before it was initialized")
 
-    def _size(self) -> int:
+    @size.instancemethod
+    def size(self) -> int:
         return len(self._data)
 
     def to_bytes(self) -> bytes:
@@ -239,6 +411,8 @@ class File(Bytes):
 
     The file is read and inserted as raw bytes.'''
 
+    __slots__ = ()
+
     def __init__(self, parent: Optional[Block], path: str) -> None:
         file_path = Path(path)
         if not file_path.is_absolute() and parent and parent.root_path:
@@ -257,6 +431,8 @@ class Empty(DataType):
     This can sometimes be useful in lieu of `None`, because SBB can parse
     it.'''
 
+    __slots__ = ('parent',)
+
     def __init__(self, parent: Optional[Block]) -> None:
         super().__init__(parent)
 
@@ -283,6 +459,8 @@ class Empty(DataType):
 
 class _Missing(DataType):
 
+    __slots__ = ('parent',)
+
     def _get_data(self) -> Any:
         raise DataMissingError("Attempted to get data of an uninitialized object")
 
@@ -308,8 +486,14 @@ class Align[T: _Primitive](Bytes):
     needed for the data structure to reach the desired byte alignment. For
     example, `Align[U32]` will align the data to the next 4-byte boundary.'''
 
+    __slots__ = ()
+
     def __init__(self, parent: Optional[Block], pad_amount: int) -> None:
-        super().__init__(parent, bytes(pad_amount))
+        if type(pad_amount) is int and 0 <= pad_amount < len(_ZERO_PADS):
+            padding = _ZERO_PADS[pad_amount]
+        else:
+            padding = bytes(pad_amount)
+        super().__init__(parent, padding)
 
 
 class Block(DataType):
@@ -319,77 +503,151 @@ class Block(DataType):
     Custom datatypes deriving from `Block` can specify their data using member
     variable annotations, which are then automatically set using data from the
     `dict` provided in instantiation. Setter methods can also be used instead
-    of populating data directly from the `dict`.'''
+    of populating data directly from the `dict`.
+
+    A `Block` is built once: after it's instantiated, its data (and the data of
+    its children) should not be modified, because its offsets, size and bytes
+    are cached.'''
 
     _current_item: _BlockItem
+    _offset_table: Optional[dict[str, int]]
+    _id_to_name: dict[int, str]
+    _built_size: int
+    _children: tuple[DataType, ...]
+    _cached_bytes: Optional[bytes]
     root_path: Optional[Path]
 
     def __init__(self, parent: Optional[Block], data: Optional[Any] = None) -> None:
-        self.size = self._size
-        self.offset_of = self._offset_of
+        self._offset_table = None
+        self._cached_bytes = None
         self.root_path = None
         if data and '_root_path' in data:
             self.root_path = data['_root_path']
         elif parent is not None and hasattr(parent, 'root_path'):
             self.root_path = parent.root_path
         super().__init__(parent)
-        try:
+        with _building(self):
             self._build(data)
-        except BuildError as e:
-            if hasattr(self, '_current_item'):
-                type_name = self.type_name()
-                prop_name = self._current_item.name
-                prop_type = self._current_item.datatype.__name__
-                if prop_name:
-                    prop_name = f' -> {prop_name}: {prop_type}'
-                e.add_note(f'{type_name}{prop_name}')
-            if self.parent is not None:
-                raise
-            raise
 
     def _build(self, data: Optional[Any]) -> None:
-        annotations = inspect.get_annotations(type(self), eval_str=True)
+        annotations = _get_anns(type(self))
+        # The property names and dependencies are the same for every instance
+        # of a class, so they are only checked the first time it's built
+        dependency_names = _DEPENDENCY_CACHE.get(type(self))
         blockitems: dict[str, _BlockItem] = {}
         for name, datatype in annotations.items():
-            if name in RESERVED_NAMES:
+            if dependency_names is None and name in RESERVED_NAMES:
                 raise BuildError(f"Name '{name}' is reserved and cannot be used as a property name")
             value = getattr(self, name, None)
             if value is None:
                 setattr(self, name, _Missing(self))
             blockitem = _BlockItem(self, name, datatype, value)
             blockitems[name] = blockitem
-        for item in blockitems.values():
-            item.set_dependencies(blockitems)
-        while any(not item.done for item in blockitems.values()):
-            success = False
+        if dependency_names is None:
+            for item in blockitems.values():
+                item.set_dependencies(blockitems)
+            _DEPENDENCY_CACHE[type(self)] = {
+                name: [d.name for d in item.dependencies] for name, item in blockitems.items()
+            }
+        else:
             for name, item in blockitems.items():
-                if item.done:
-                    continue
-                if any(not d.done for d in item.dependencies):
-                    continue
-                self._current_item = item
-                item.build(data)
-                success = True
-                setattr(self, item.name, item.value)
-            if not success:
-                failed = [item.name for item in blockitems.values() if not item.done]
-                raise BuildError(("Couldn't build all items. Check for circular "
-                "dependencies in these properties of "
-                f"{type(self).__name__}:\n{failed}"))
+                item.dependencies = [blockitems[d] for d in dependency_names[name]]
+        # Build items in dependency order (Kahn's algorithm), in passes over
+        # the declaration order, since setters may rely on dependencies that
+        # can't be detected. An item that becomes ready joins the current pass
+        # only if it's declared after the item that was just built.
+        positions: dict[_BlockItem, int] = {}
+        waiting_on: dict[_BlockItem, int] = {}
+        dependents: defaultdict[_BlockItem, list[_BlockItem]] = defaultdict(list)
+        ready: list[tuple[int, _BlockItem]] = []
+        for position, item in enumerate(blockitems.values()):
+            if item.done:
+                continue
+            positions[item] = position
+            deps = [d for d in item.dependencies if not d.done]
+            for dep in deps:
+                dependents[dep].append(item)
+            waiting_on[item] = len(deps)
+            if not deps:
+                ready.append((position, item))
+        heapq.heapify(ready)
+        next_pass: list[tuple[int, _BlockItem]] = []
+        # Aligns are placed using a running offset through the properties in
+        # declaration order. Each Align depends on all preceding properties
+        # without a static size (including other Aligns), so they are always
+        # reached in order.
+        preceding = iter(blockitems.values())
+        running_offset = 0
+        while ready:
+            position, item = heapq.heappop(ready)
+            self._current_item = item
+            # A setter may have caught a failed build of another object
+            _current_build.set(self)
+            if item.datatype is Align:
+                for prev in preceding:
+                    if prev is item:
+                        item.offset = running_offset
+                        break
+                    attr = getattr(self, prev.name)
+                    if type(attr) is _Missing:
+                        attr = prev.datatype
+                    running_offset += attr.size()
+            item.build(data)
+            setattr(self, item.name, item.value)
+            if item.offset is not None:
+                running_offset += item.value.size()
+            for dependent in dependents[item]:
+                waiting_on[dependent] -= 1
+                if waiting_on[dependent] == 0:
+                    if positions[dependent] > position:
+                        heapq.heappush(ready, (positions[dependent], dependent))
+                    else:
+                        heapq.heappush(next_pass, (positions[dependent], dependent))
+            if not ready:
+                ready, next_pass = next_pass, ready
+        failed = [item.name for item in blockitems.values() if not item.done]
+        if failed:
+            raise BuildError(("Couldn't build all items. Check for circular "
+            "dependencies in these properties of "
+            f"{type(self).__name__}:\n{failed}"))
+        self._build_offset_table()
+
+    def _build_offset_table(self) -> None:
+        # Blocks are build-once, so once every property is populated, the
+        # children, offsets and total size can be computed in a single pass
+        offset = 0
+        offset_table = {}
+        id_to_name = {}
+        children = []
+        for name in _get_anns(type(self)):
+            attr = getattr(self, name)
+            children.append(attr)
+            offset_table[name] = offset
+            id_to_name.setdefault(id(attr), name)
+            offset += attr.size()
+        self._children = tuple(children)
+        self._id_to_name = id_to_name
+        self._built_size = offset
+        self._offset_table = offset_table
 
     def _get_data(self) -> Sequence[DataType]:
+        if self._offset_table is not None:
+            return self._children
         data = []
-        for name in inspect.get_annotations(type(self), eval_str=True):
+        for name in _get_anns(type(self)):
             data.append(getattr(self, name))
         return data
 
-    @classmethod
+    @_hybridmethod
     def size(cls) -> int:
-        return sum(datatype.size() for datatype in inspect.get_annotations(cls, eval_str=True).values())
+        return sum(datatype.size() for datatype in _get_anns(cls).values())
 
-    def _size(self) -> int:
+    @size.instancemethod
+    def size(self) -> int:
+        if self._offset_table is not None:
+            return self._built_size
         size = 0
-        for name, datatype in inspect.get_annotations(type(self), eval_str=True).items():
+        for name, datatype in _get_anns(type(self)).items():
             attr = getattr(self, name, datatype)
             if type(attr) is _Missing:
                 attr = datatype
@@ -397,26 +655,15 @@ class Block(DataType):
         return size
 
     def to_bytes(self) -> bytes:
-        return b''.join(d.to_bytes() for d in self._get_data())
+        # Blocks are build-once, so the bytes only need to be generated once
+        if self._cached_bytes is None:
+            self._cached_bytes = b''.join(d.to_bytes() for d in self._get_data())
+        return self._cached_bytes
 
     def _validate(self) -> None:
         pass
 
-    def _offset_of(self, prop_name: str) -> int:
-        offset = 0
-        annotations = inspect.get_annotations(type(self), eval_str=True)
-        if not prop_name in annotations:
-            raise BuildError(f"Property name '{prop_name}' does not exist in {type(self).__name__}")
-        for name, datatype in annotations.items():
-            if name == prop_name:
-                return offset
-            attr = getattr(self, name, datatype)
-            if type(attr) is _Missing:
-                attr = datatype
-            offset += attr.size()
-        raise ValueError(f"Property name {prop_name} does not exist in {self.type_name()}")
-
-    @classmethod
+    @_hybridmethod
     def offset_of(cls, prop_name: str) -> int:
         '''Gets the offset (in bytes) of the given property name. This works as
         both a class method (for statically-known offsets) and as an instance
@@ -429,7 +676,7 @@ class Block(DataType):
         method can be useful in edge cases where `offset()` doesn't work.'''
 
         offset = 0
-        annotations = inspect.get_annotations(cls, eval_str=True)
+        annotations = _get_anns(cls)
         if not prop_name in annotations:
             raise BuildError(f"Property name '{prop_name}' does not exist in {cls.__name__}")
         for name, datatype in annotations.items():
@@ -438,14 +685,33 @@ class Block(DataType):
             offset += datatype.size()
         return offset
 
+    @offset_of.instancemethod
+    def offset_of(self, prop_name: str) -> int:
+        offset = 0
+        annotations = _get_anns(type(self))
+        if not prop_name in annotations:
+            raise BuildError(f"Property name '{prop_name}' does not exist in {type(self).__name__}")
+        if self._offset_table is not None:
+            return self._offset_table[prop_name]
+        for name, datatype in annotations.items():
+            if name == prop_name:
+                return offset
+            attr = getattr(self, name, datatype)
+            if type(attr) is _Missing:
+                attr = datatype
+            offset += attr.size()
+        raise ValueError(f"Property name {prop_name} does not exist in {self.type_name()}")
+
 
 class _BlockItem:
-    done: bool = False
+    __slots__ = ('done', 'owner', 'offset', 'name', 'datatype', 'argtype', 'value', 'setter', 'dependencies')
+
+    done: bool
     owner: Block
-    offset: Optional[int] = None
+    offset: Optional[int]
     name: str
     datatype: type
-    argtype: Optional[type] = None
+    argtype: Optional[type]
     value: DataType
     setter: Optional[Callable]
     dependencies: list[_BlockItem]
@@ -453,6 +719,9 @@ class _BlockItem:
     def __init__(self, owner: Block, name: str, datatype: type, value: Optional[DataType]) -> None:
         self.owner = owner
         self.name = name
+        self.done = False
+        self.offset = None
+        self.argtype = None
         if value is not None:
             self.value = value
             self.done = True
@@ -474,7 +743,7 @@ class _BlockItem:
             self.dependencies = []
             return
         deps = []
-        closures = inspect.getclosurevars(self.setter).unbound
+        closures = _get_setter_names(self.setter)
         if 'offset' in closures or 'offset_of' in closures:
             deps += self._get_offset_dependencies(self.setter, items)
         dep_names = [c for c in closures if c in items]
@@ -483,7 +752,7 @@ class _BlockItem:
                 deps.append(items[name])
         # Check if self-dependency is just offset()
         if self in deps and self.setter:
-            source = inspect.getsource(self.setter)
+            source, _ = _get_setter_source(self.setter)
             offset_hits = source.count(f'self.{self.name}.offset()')
             total_hits = source.count(f'self.{self.name}')
             if offset_hits == total_hits:
@@ -501,7 +770,10 @@ class _BlockItem:
             if not hasattr(self.argtype, 'static_size'):
                 raise BuildError(f"Align argument must be a primitive type with a statically-known size")
             alignment = self.argtype.static_size()
-            offset_mod = (self.owner.offset_of(self.name) - 1) % alignment + 1
+            offset = self.offset
+            if offset is None:
+                offset = self.owner.offset_of(self.name)
+            offset_mod = (offset - 1) % alignment + 1
             pad_needed = alignment - offset_mod
             value = Align(self.owner, pad_needed)
         else:
@@ -511,7 +783,7 @@ class _BlockItem:
 
     def _get_align_dependencies(self, items: dict[str, _BlockItem]) -> list[_BlockItem]:
         deps = []
-        owner_props = list(inspect.get_annotations(type(self.owner)))
+        owner_props = list(_get_anns(type(self.owner)))
         for prop in owner_props:
             if prop == self.name:
                 break
@@ -521,11 +793,9 @@ class _BlockItem:
 
 
     def _get_offset_dependencies(self, setter: Callable, items: dict[str, _BlockItem]) -> list[_BlockItem]:
-        source = inspect.getsource(setter)
+        _, called_props = _get_setter_source(setter)
         dep_names = []
-        called_props = re.findall(r'self\.(.+?).offset\(\)', source)
-        called_props += re.findall(r'self\.offset_of\([\'|"](.+?)[\'|"]\)', source)
-        owner_props = list(inspect.get_annotations(type(self.owner)))
+        owner_props = list(_get_anns(type(self.owner)))
         for prop in called_props:
             prop_index = owner_props.index(prop)
             dep_names += owner_props[0:prop_index]
@@ -548,31 +818,71 @@ class Array[T: DataType](Block, list[T]):
     '''A raw array of items in the specified type.'''
 
     def __init__(self, parent: Optional[Block], datatype: Optional[type] = None, data: list = []) -> None:
-        self.size = self._size
         self._data = data
+        self._id_to_index = {}
+        self._element_offsets = [0]
+        self._element_size = None
+        if hasattr(datatype, 'static_size'):
+            self._element_size = datatype.static_size()
+        self._datatype = datatype
+        self._elements_built = False
+        self._pack_format = None
+        if (isinstance(datatype, type) and issubclass(datatype, _Primitive)
+                and datatype.to_bytes is _Primitive.to_bytes):
+            self._pack_format = _PACK_FORMATS.get(datatype.static_size())
         super().__init__(parent)
-        if datatype:
+        if not datatype:
+            self._elements_built = True
+            return
+        with _building(self):
             for item in data:
-                try:
-                    self.append(datatype(self, item))
-                except BuildError as e:
-                    prop_name = f'Array[{datatype.__name__}]'
-                    prop_name += f' -> (element {len(self)})'
-                    e.add_note(prop_name)
-                    raise
+                elem = datatype(self, item)
+                if self._element_size is None:
+                    elem_end = self._element_offsets[-1] + elem.size()
+                    self._element_offsets.append(elem_end)
+                self._id_to_index[id(elem)] = len(self)
+                self.append(elem)
+        self._elements_built = True
 
     def _get_data(self) -> Sequence[DataType]:
         return self
 
-    @classmethod
+    @_hybridmethod
     def size(cls) -> int:
         raise DataMissingError("Attempted to get size of an Array before it was initialized")
 
-    def _size(self) -> int:
+    @size.instancemethod
+    def size(self) -> int:
+        if self._has_element_offsets():
+            return self._element_offset(len(self))
         return sum(d.size() for d in self)
 
+    def _has_element_offsets(self) -> bool:
+        # The offsets are only trustworthy if the list hasn't been modified
+        # outside of __init__
+        return len(self._id_to_index) == len(self)
+
+    def _element_offset(self, index: int) -> int:
+        # Elements with a statically-known size don't need an offset table
+        if self._element_size is not None:
+            return index * self._element_size
+        return self._element_offsets[index]
+
     def to_bytes(self) -> bytes:
-        return b''.join(d.to_bytes() for d in self)
+        if self._cached_bytes is not None and self._has_element_offsets():
+            return self._cached_bytes
+        if self._pack_format and self._has_element_offsets():
+            # Arrays of primitives are packed in one call, masking signed
+            # values to their two's complement
+            mask = self._datatype._range_max
+            fmt = f'>{len(self)}{self._pack_format}'
+            data = struct.pack(fmt, *(d._data & mask for d in self))
+        else:
+            data = b''.join(d.to_bytes() for d in self)
+        # Elements may still be appended while __init__ is running
+        if self._elements_built and self._has_element_offsets():
+            self._cached_bytes = data
+        return data
 
     def _validate(self) -> None:
         if not isinstance(self._data, Iterable):